@@ -4,7 +4,7 @@ SEIMple - Simple HTTP query API for SQLite logs (MVP)
 
 Usage:
   # install deps in your venv first
-  pip install fastapi uvicorn python-dateutil
+  pip install fastapi uvicorn python-dateutil orjson
 
   # run the API (default host 127.0.0.1 port 8000)
   uvicorn seimple_api:app --reload
@@ -16,22 +16,100 @@ Endpoints:
   GET /logs
     - query logs with optional filters:
       ?host=...        (exact match)
-      &q=...           (text search in message, case-insensitive substring)
+      &q=...           (text search in message, case-insensitive word-prefix match;
+                        falls back to substring match if q contains punctuation;
+                        needs >= 3 chars unless host or since is also given)
       &since=ISO8601   (inclusive, e.g., 2025-11-13T00:00:00Z)
       &until=ISO8601   (inclusive)
       &limit=N         (max records; default 100, max 1000)
+
+Note: /logs pins idx_logs_host_ts / idx_logs_ts_utc with INDEXED BY, so the DB
+must have been opened at least once by the collector (its init_db creates the
+indexes and FTS table); otherwise /logs fails with "no such index".
 """
 
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi import FastAPI, HTTPException, Query, Response
+from typing import Optional
+from contextlib import asynccontextmanager, contextmanager
 import sqlite3
+import orjson
+import queue
+import threading
 from dateutil import parser as dateparser
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 DB_PATH = "seimple_logs_v2.db"
 
-app = FastAPI(title="SEIMple API", version="v0.2")
+# Timestamps are stored as INTEGER microseconds since the epoch (UTC)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Bounded pool of read-only connections per DB path, checked out per request.
+# Worker threads come and go, so connections belong to the pool, not to a thread.
+POOL_SIZE = 8
+POOL_TIMEOUT = 30  # seconds to wait for a free connection once POOL_SIZE are open
+_pools = {}        # path -> LifoQueue of idle connections (most recently used first)
+_pool_open = {}    # path -> number of connections opened for that path
+_pool_lock = threading.Lock()
+
+def _open_db_conn(path):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=1")
+    # Serve the hot index tail from memory instead of pread() per page
+    conn.execute("PRAGMA mmap_size=1073741824")  # 1 GiB
+    # Kept modest: up to POOL_SIZE of these per path (8 x 8 MiB); mmap covers hot pages
+    conn.execute("PRAGMA cache_size=-8192")       # 8 MiB
+    return conn
+
+@contextmanager
+def get_db_conn(path=DB_PATH):
+    """
+    Check out a pooled connection to path for the duration of the with block.
+    Opens a new one while fewer than POOL_SIZE exist, otherwise waits for one
+    to be returned (queue.Empty after POOL_TIMEOUT seconds).
+    """
+    with _pool_lock:
+        pool = _pools.setdefault(path, queue.LifoQueue())
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = None
+            if _pool_open.get(path, 0) < POOL_SIZE:
+                _pool_open[path] = _pool_open.get(path, 0) + 1
+                opening = True
+            else:
+                opening = False
+    if conn is None:
+        if opening:
+            try:
+                conn = _open_db_conn(path)
+            except Exception:
+                with _pool_lock:
+                    _pool_open[path] -= 1
+                raise
+        else:
+            conn = pool.get(timeout=POOL_TIMEOUT)
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+def close_db_conns():
+    with _pool_lock:
+        for path, pool in _pools.items():
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+            _pool_open[path] = 0
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    close_db_conns()
+
+app = FastAPI(title="SEIMple API", version="v0.2", lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -42,43 +120,62 @@ app.add_middleware(
   allow_headers=["*"],
 )
 
-class LogRow(BaseModel):
-    id: int
-    received_at: str
-    pri: Optional[int] = None
-    ts_text: Optional[str] = None
-    ts_utc: Optional[str] = None
-    host: Optional[str] = None
-    msg: Optional[str] = None
+def fts_query(q):
+    """
+    Translate a free-text q into an FTS5 MATCH expression ("foo"* "bar"*),
+    i.e. every word must appear as a word prefix. Returns None if q contains
+    characters the unicode61 tokenizer would drop, so the caller can use LIKE.
+    """
+    if not all(ch.isalnum() or ch.isspace() for ch in q):
+        return None
+    return " ".join(f'"{tok}"*' for tok in q.split()) or None
 
-def get_db_conn(path=DB_PATH):
-    # Each request will create a new connection; lightweight for SQLite.
-    conn = sqlite3.connect(path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+def parse_iso(s):
+    """
+    Parse an ISO8601 timestamp with datetime.fromisoformat (cheap), falling
+    back to dateutil's format-sniffing parser for anything else.
+    """
+    try:
+        return datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except ValueError:
+        return dateparser.parse(s)
+
+def to_us(dt):
+    """Timezone-aware datetime -> microseconds since the epoch (DB representation)."""
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+def us_to_iso(us):
+    """Microseconds since the epoch -> ISO8601 UTC string with 'Z' (None stays None)."""
+    if us is None:
+        return None
+    return (EPOCH + timedelta(microseconds=us)).isoformat().replace("+00:00", "Z")
+
+def row_to_dict(r):
+    d = dict(r)
+    d["received_at"] = us_to_iso(d["received_at"])
+    d["ts_utc"] = us_to_iso(d["ts_utc"])
+    return d
 
 @app.get("/health")
 def health():
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        conn.close()
+        with get_db_conn() as conn:
+            conn.execute("SELECT 1")
         return {"status": "ok"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/logs", response_model=List[LogRow])
+@app.get("/logs")
 def query_logs(
     host: Optional[str] = Query(None, description="Exact host match"),
-    q: Optional[str] = Query(None, description="Text search in message (substring, case-insensitive)"),
+    q: Optional[str] = Query(None, description="Text search in message (word prefix, case-insensitive)"),
     since: Optional[str] = Query(None, description="ISO8601 UTC start time (inclusive)"),
     until: Optional[str] = Query(None, description="ISO8601 UTC end time (inclusive)"),
     limit: int = Query(100, gt=0, le=1000, description="Max number of rows returned"),
 ):
     """
     Build a parameterized SQL query based on provided filters.
-    Uses ts_utc or received_at for time comparisons where possible.
+    Uses ts_utc (populated by the collector for every row) for time comparisons.
     """
 
     # Validate/parse time boundaries if provided
@@ -86,65 +183,80 @@ def query_logs(
     until_dt = None
     try:
         if since:
-            since_dt = dateparser.parse(since)
+            since_dt = parse_iso(since)
             if since_dt.tzinfo is None:
                 # assume UTC if user omitted timezone
                 since_dt = since_dt.replace(tzinfo=timezone.utc)
         if until:
-            until_dt = dateparser.parse(until)
+            until_dt = parse_iso(until)
             if until_dt.tzinfo is None:
                 until_dt = until_dt.replace(tzinfo=timezone.utc)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid date format: {e}")
 
-    # We will compare using ts_utc when available, fallback to received_at
-    # For simplicity we use SQLite's COALESCE(ts_utc, received_at)
+    # Cheap reject before touching the DB: a 1-2 char q matches almost every row,
+    # so only allow it when host/since already narrows the scan
+    if q and len(q.strip()) < 3 and not host and not since_dt:
+        raise HTTPException(status_code=400, detail="q requires at least 3 characters or a host/since filter")
+
+    # The collector always populates ts_utc (falling back to received_at),
+    # so comparisons hit idx_logs_ts_utc / idx_logs_host_ts directly
     sql = "SELECT id, received_at, pri, ts_text, ts_utc, host, msg FROM logs"
     where_clauses = []
     params = []
+    match = None
 
     if host:
         where_clauses.append("host = ?")
         params.append(host)
 
     if q:
-        # case-insensitive substring search
-        where_clauses.append("LOWER(msg) LIKE ?")
-        params.append(f"%{q.lower()}%")
+        match = fts_query(q)
+        if match:
+            # word-prefix search through the logs_fts inverted index
+            where_clauses.append("id IN (SELECT rowid FROM logs_fts WHERE logs_fts MATCH ?)")
+            params.append(match)
+        else:
+            # substring search; SQLite's LIKE is already case-insensitive for ASCII,
+            # so skip evaluating LOWER(msg) on every scanned row
+            where_clauses.append("msg LIKE ?")
+            params.append(f"%{q}%")
 
     if since_dt:
-        where_clauses.append("COALESCE(ts_utc, received_at) >= ?")
-        params.append(since_dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z"))
+        where_clauses.append("ts_utc >= ?")
+        params.append(to_us(since_dt))
 
     if until_dt:
-        where_clauses.append("COALESCE(ts_utc, received_at) <= ?")
-        params.append(until_dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z"))
+        where_clauses.append("ts_utc <= ?")
+        params.append(to_us(until_dt))
+
+    # Walk the index that already yields rows in ts_utc DESC order so LIMIT can
+    # stop early and SQLite never builds a temp B-tree for the ORDER BY.
+    # FTS searches are left to the planner: it drives from the logs_fts rowids,
+    # which is O(matches) instead of a walk over the whole timestamp index.
+    if not match:
+        if host:
+            sql += " INDEXED BY idx_logs_host_ts"
+        else:
+            sql += " INDEXED BY idx_logs_ts_utc"
 
     if where_clauses:
         sql += " WHERE " + " AND ".join(where_clauses)
 
-    sql += " ORDER BY COALESCE(ts_utc, received_at) DESC"
+    sql += " ORDER BY ts_utc DESC"
     sql += " LIMIT ?"
     params.append(limit)
 
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        conn.close()
-
-        results = []
-        for r in rows:
-            results.append(LogRow(
-                id=r["id"],
-                received_at=r["received_at"],
-                pri=r["pri"],
-                ts_text=r["ts_text"],
-                ts_utc=r["ts_utc"],
-                host=r["host"],
-                msg=r["msg"],
-            ))
-        return results
+        with get_db_conn() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                # Encode each row as it comes off the cursor (no fetchall() / list of dicts);
+                # rows already match the schema, so there is no per-row model validation
+                body = b"[" + b",".join(orjson.dumps(row_to_dict(r)) for r in cur) + b"]"
+            finally:
+                cur.close()
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
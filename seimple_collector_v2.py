@@ -2,124 +2,318 @@
 """
 SEIMple - Improved UDP syslog collector (v2)
 Features:
+ - single-threaded asyncio UDP receiver; DB writes are batched on a separate writer thread
  - timezone-aware UTC timestamps (no utcnow() deprecation warning)
  - parse RFC3164-style timestamps (e.g., "Nov 13 12:34:56") by inferring year & handling rollover
- - store both raw timestamp text and normalized ts_utc (ISO8601 Z)
- - optional JSON body parsing (stores raw msg; parsed JSON fields are ignored for DB columns in this MVP)
+ - store both raw timestamp text and normalized ts_utc (INTEGER microseconds since the epoch, falls back to received_at)
+ - JSON bodies are stored verbatim in msg (no parsing on the receive path in this MVP)
 """
 
-import socketserver
+import asyncio
 import sqlite3
 import threading
-from datetime import datetime, timezone
+import queue
+import time
+from datetime import datetime, timedelta, timezone
 import re
 import os
 import argparse
-import json
+import logging
 
 DB_PATH = "seimple_logs_v2.db"
 
-# Lenient RFC3164-ish regex to extract PRI, timestamp text, host, and message
+# Per-message output is DEBUG level (off unless --verbose); write failures are ERROR
+log = logging.getLogger("seimple")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# RFC3164 month abbreviations (avoids strptime's format parsing per message)
+_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+# Handlers only enqueue rows; a single writer thread batches them into SQLite
+WRITE_BATCH_SIZE = 500
+_write_q = queue.Queue()
+
+# Highest valid syslog PRI (facility 23 * 8 + severity 7); anything above is stored as NULL
+MAX_PRI = 191
+
+# Current time in microseconds since the epoch (millisecond resolution), evaluated by
+# SQLite. 'now' is fixed for the whole statement step, so the received_at default and
+# the ts_utc fallback below get the same value for a row.
+NOW_US_SQL = "CAST(round((julianday('now') - 2440587.5) * 86400000) AS INTEGER) * 1000"
+INSERT_SQL = (
+    "INSERT INTO logs (pri, ts_text, ts_utc, host, msg) "
+    f"VALUES (?, ?, COALESCE(?, {NOW_US_SQL}), ?, ?)"
+)
+
+# Lenient RFC3164-ish regex to extract PRI, timestamp text and host.
+# Only the header is matched; the message is whatever follows m.end().
 SYSLOG_RE = re.compile(
-    r'^(?:<(?P<pri>\d+)>)?'                      # optional <PRI>
+    r'^(?:<(?P<pri>\d{1,3})>)?'                  # optional <PRI>
     r'(?P<timestamp>\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2})\s+'  # e.g., "Nov 13 12:34:56"
     r'(?P<host>[\w\.\-]+)?\s*'                   # optional host
-    r'(?P<msg>.*)$',
-    re.DOTALL
 )
 
+def iso_to_us(text):
+    """
+    ISO8601 UTC string (pre-INTEGER schema) -> microseconds since the epoch, or None.
+    Values that are already integers are returned unchanged.
+    """
+    if isinstance(text, int):
+        return text
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
 def init_db(db_path=DB_PATH):
     conn = sqlite3.connect(db_path, check_same_thread=False)
+    # page_size only takes effect on a brand-new DB (before WAL / the first table)
+    conn.execute("PRAGMA page_size=8192")
+    # WAL lets the API read while the collector writes; NORMAL sync is safe under WAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=1073741824")  # 1 GiB: reads come from the OS page cache
+    conn.execute("PRAGMA cache_size=-65536")      # 64 MiB
     cur = conn.cursor()
-    cur.execute("""
+    cur.execute("BEGIN")
+    # Older databases store timestamps as ISO TEXT, or lack the received_at default;
+    # move those aside so the table can be recreated with the current schema.
+    cols = {row[1]: (row[2], row[4]) for row in cur.execute("PRAGMA table_info(logs)")}
+    received_type, received_default = cols.get("received_at", (None, None))
+    legacy = bool(cols) and (received_type != "INTEGER" or received_default is None)
+    if legacy:
+        cur.execute("ALTER TABLE logs RENAME TO logs_legacy")
+    cur.execute(f"""
     CREATE TABLE IF NOT EXISTS logs (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        received_at TEXT NOT NULL,   -- when collector received the message (UTC, ISO)
+        received_at INTEGER NOT NULL DEFAULT ({NOW_US_SQL}), -- when collector received the message (UTC, microseconds since epoch)
         pri INTEGER,
         ts_text TEXT,               -- original timestamp text from syslog (if present)
-        ts_utc TEXT,                -- normalized timestamp (UTC ISO) when parsing succeeds
+        ts_utc INTEGER,             -- normalized timestamp (UTC, microseconds since epoch); falls back to received_at
         host TEXT,
         msg TEXT
     )
     """)
+    if legacy:
+        # ids (and msg) are kept as-is, so the logs_fts index stays valid
+        conn.create_function("iso_to_us", 1, iso_to_us, deterministic=True)
+        cur.execute("""
+        INSERT INTO logs (id, received_at, pri, ts_text, ts_utc, host, msg)
+        SELECT id, iso_to_us(received_at), pri, ts_text, iso_to_us(ts_utc), host, msg
+        FROM logs_legacy
+        """)
+        # also drops the old table's indexes and triggers; they are recreated below
+        cur.execute("DROP TABLE logs_legacy")
+    # Rows stored before the fallback existed may have a NULL ts_utc
+    cur.execute("UPDATE logs SET ts_utc = received_at WHERE ts_utc IS NULL")
+    conn.commit()
+    # Indexes backing the /logs API filters (host + time range, newest first).
+    # The API pins them with INDEXED BY (except for FTS searches, where the planner
+    # drives from logs_fts). Keep this set minimal: a host-only index
+    # is covered by the leading column of idx_logs_host_ts and would only tempt the
+    # planner away from the time-ordered scan; nothing filters on received_at.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_ts_utc ON logs(ts_utc DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_logs_host_ts ON logs(host, ts_utc DESC)")
+    cur.execute("DROP INDEX IF EXISTS idx_logs_received")
+    # refresh sqlite_stat1 so the planner has real selectivity numbers
+    cur.execute("ANALYZE logs")
+
+    # Full-text index over msg for the API's q= search, kept in sync by triggers
+    fts_exists = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='logs_fts'"
+    ).fetchone()
+    cur.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts "
+        "USING fts5(msg, content='logs', content_rowid='id', tokenize='unicode61')"
+    )
+    cur.executescript("""
+    CREATE TRIGGER IF NOT EXISTS logs_ai AFTER INSERT ON logs BEGIN
+        INSERT INTO logs_fts(rowid, msg) VALUES (new.id, new.msg);
+    END;
+    CREATE TRIGGER IF NOT EXISTS logs_ad AFTER DELETE ON logs BEGIN
+        INSERT INTO logs_fts(logs_fts, rowid, msg) VALUES ('delete', old.id, old.msg);
+    END;
+    CREATE TRIGGER IF NOT EXISTS logs_au AFTER UPDATE OF msg ON logs BEGIN
+        INSERT INTO logs_fts(logs_fts, rowid, msg) VALUES ('delete', old.id, old.msg);
+        INSERT INTO logs_fts(rowid, msg) VALUES (new.id, new.msg);
+    END;
+    """)
+    if not fts_exists:
+        # index rows that were stored before the FTS table existed
+        cur.execute("INSERT INTO logs_fts(logs_fts) VALUES ('rebuild')")
     conn.commit()
     return conn
 
+def db_writer(conn, q=_write_q):
+    """
+    Drain queued rows and insert them with one executemany/commit per batch.
+    Runs in its own thread; a None item flushes and stops the loop.
+    """
+    ins = conn.cursor()  # one cursor for the writer's lifetime; INSERT_SQL stays prepared
+    running = True
+    while running:
+        batch = [q.get()]
+        if batch[0] is None:
+            break
+        # take whatever else is already queued, up to WRITE_BATCH_SIZE rows
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                row = q.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                running = False
+                break
+            batch.append(row)
+        try:
+            ins.executemany(INSERT_SQL, batch)
+            conn.commit()
+        except Exception:
+            # keep the writer alive: retry row by row so one bad row doesn't cost the batch
+            conn.rollback()
+            log.exception("DB batch write failed; retrying %d rows individually", len(batch))
+            for row in batch:
+                try:
+                    ins.execute(INSERT_SQL, row)
+                except Exception:
+                    log.exception("DB write failed, row dropped: %r", row[:4])
+            conn.commit()
+
 def parse_rfc3164_timestamp(ts_text):
     """
     Parse timestamps like "Nov 13 12:34:56" into a timezone-aware UTC datetime.
     Since the year isn't present, infer the year by using the current year and
     correcting for future dates (assume logs are not more than ~6 months in the future).
-    Returns an ISO8601 UTC string with 'Z' or None if parsing fails.
+    Returns microseconds since the epoch (int) or None if parsing fails.
     """
     try:
+        if len(ts_text) == 15:
+            # fixed width: "Nov 13 12:34:56" / "Nov  3 12:34:56"
+            mon = _MONTHS[ts_text[:3].title()]
+            day = int(ts_text[4:6])
+            h = int(ts_text[7:9])
+            mi = int(ts_text[10:12])
+            s = int(ts_text[13:15])
+        else:
+            # the regex fallback also accepts e.g. "Nov 3 12:34:56"
+            mon_text, day_text, clock = ts_text.split()
+            mon = _MONTHS[mon_text.title()]
+            day = int(day_text)
+            h, mi, s = (int(part) for part in clock.split(':'))
         # parse month/day/time with current year
         now = datetime.now(timezone.utc)
-        candidate = datetime.strptime(f"{ts_text} {now.year}", "%b %d %H:%M:%S %Y")
-        # make timezone-aware (assume timestamp is local machine's localtime)
         # For simplicity assume logs originate in the collector's local timezone -> convert to UTC
         # Here we assume localtime is the system local timezone; to be precise we'd need tzinfo library.
-        candidate = candidate.replace(tzinfo=timezone.utc)  # treat as UTC to keep MVP simple
+        candidate = datetime(now.year, mon, day, h, mi, s, tzinfo=timezone.utc)  # treat as UTC to keep MVP simple
         # Handle year rollover: if candidate is more than ~180 days in the future, subtract 1 year
         delta = candidate - now
         if delta.days > 180:
             candidate = candidate.replace(year=candidate.year - 1)
-        return candidate.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+        return int(candidate.timestamp()) * 1_000_000
     except Exception:
         return None
 
-class SyslogUDPHandler(socketserver.BaseRequestHandler):
-    db_lock = threading.Lock()
-    db_conn = None
+def parse_syslog_bytes(data):
+    """
+    Fast path for the common "<PRI>Mmm dd hh:mm:ss host msg" layout.
+    Slices the raw datagram bytes directly instead of running SYSLOG_RE.
+    Returns (pri, ts_text, host, msg) or None if the layout doesn't fit,
+    in which case the caller should fall back to the regex.
+    """
+    pri = None
+    pos = 0
+    if data[:1] == b'<':
+        gt = data.find(b'>', 1, 5)
+        if gt < 2 or not data[1:gt].isdigit():
+            return None
+        pri = int(data[1:gt])
+        if pri > MAX_PRI:
+            pri = None
+        pos = gt + 1
+
+    # RFC3164 timestamp is fixed width: "Nov 13 12:34:56" / "Nov  3 12:34:56"
+    ts = data[pos:pos + 15]
+    if (len(ts) != 15 or not ts[:3].isalpha() or ts[3] != 0x20
+            or not (ts[4] == 0x20 or ts[4:5].isdigit()) or not ts[5:6].isdigit()
+            or ts[6] != 0x20 or ts[9] != 0x3a or ts[12] != 0x3a
+            or not (ts[7:9] + ts[10:12] + ts[13:15]).isdigit()
+            or data[pos + 15:pos + 16] != b' '):
+        return None
+
+    start = pos + 16
+    sp = data.find(b' ', start)
+    if sp < 0:
+        host = data[start:]
+        msg = ""
+    else:
+        host = data[start:sp]
+        # strip after decoding so Unicode whitespace (NBSP, \x1c-\x1f) goes too, like SYSLOG_RE's \s*
+        msg = data[sp + 1:].decode(errors='replace').lstrip()
+    # host must look like [\w.-]+ (same as SYSLOG_RE), otherwise let the regex decide
+    if not host.replace(b'.', b'').replace(b'-', b'').replace(b'_', b'').isalnum():
+        return None
 
-    def handle(self):
-        data = self.request[0].strip()
-        text = data.decode(errors='replace')
-        src_ip, src_port = self.client_address
-        received_at = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    return pri, ts.decode('ascii'), host.decode('ascii'), msg
+
+class SyslogProtocol(asyncio.DatagramProtocol):
+    """
+    Parses each datagram on the event loop thread and queues the row for db_writer.
+    No per-packet thread is spawned.
+    """
+    def __init__(self, write_q=_write_q):
+        self.write_q = write_q
+
+    def datagram_received(self, data, addr):
+        data = data.strip()
+        src_ip, src_port = addr[0], addr[1]
 
         # Defaults
         pri = None
         ts_text = None
         ts_utc = None
         host = None
-        msg = text
-
-        # Try to match the lenient syslog regex
-        m = SYSLOG_RE.match(text)
-        if m:
-            pri = int(m.group('pri')) if m.group('pri') else None
-            ts_text = m.group('timestamp')
-            host = m.group('host') or src_ip
-            msg = m.group('msg') or ""
-            # try to normalize timestamp text
+
+        # Common layout is parsed straight from bytes; only unusual packets hit the regex
+        parsed = parse_syslog_bytes(data)
+        if parsed is not None:
+            pri, ts_text, host, msg = parsed
             ts_utc = parse_rfc3164_timestamp(ts_text)
         else:
-            # If not matching, fall back to using src_ip as host
-            host = src_ip
-
-        # Try to detect JSON payloads (optional)
-        # We DO NOT change DB schema; this is for future enrichment.
-        parsed_json = None
-        stripped = msg.strip()
-        if stripped.startswith("{") and stripped.endswith("}"):
-            try:
-                parsed_json = json.loads(stripped)
-            except Exception:
-                parsed_json = None
-
-        # Insert into DB (thread-safe)
-        with self.db_lock:
-            cur = self.db_conn.cursor()
-            cur.execute(
-                "INSERT INTO logs (received_at, pri, ts_text, ts_utc, host, msg) VALUES (?, ?, ?, ?, ?, ?)",
-                (received_at, pri, ts_text, ts_utc, host, msg)
-            )
-            self.db_conn.commit()
-
-        # Console output (short)
-        display_ts = ts_utc or ts_text or received_at
-        print(f"[{display_ts}] {host}:{src_port} -> {msg[:200]}")
+            text = data.decode(errors='replace')
+            msg = text
+            # Try to match the lenient syslog regex
+            m = SYSLOG_RE.match(text)
+            if m:
+                pri = int(m.group('pri')) if m.group('pri') else None
+                if pri is not None and pri > MAX_PRI:
+                    pri = None
+                ts_text = m.group('timestamp')
+                host = m.group('host') or src_ip
+                msg = text[m.end():]
+                # try to normalize timestamp text
+                ts_utc = parse_rfc3164_timestamp(ts_text)
+            else:
+                # If not matching, fall back to using src_ip as host
+                host = src_ip
+
+        # Hand off to the writer thread (no lock or commit on the UDP path).
+        # SQLite fills in received_at, and ts_utc falls back to it when None (see INSERT_SQL)
+        # so the API can always filter/sort on ts_utc via index.
+        self.write_q.put_nowait((pri, ts_text, ts_utc, host, msg))
+
+        # Console output (short); skip formatting entirely unless DEBUG is enabled
+        if log.isEnabledFor(logging.DEBUG):
+            shown_us = ts_utc if ts_utc is not None else time.time_ns() // 1000
+            display_ts = (EPOCH + timedelta(microseconds=shown_us)).isoformat().replace("+00:00", "Z")
+            log.debug("[%s] %s:%d -> %s", display_ts, host, src_port, msg[:200])
 
 def run_server(listen_addr="0.0.0.0", port=5514, db_path=DB_PATH):
     # On Windows, checking os.geteuid() isn't available; guard that call
@@ -131,16 +325,24 @@ def run_server(listen_addr="0.0.0.0", port=5514, db_path=DB_PATH):
         pass
 
     conn = init_db(db_path)
-    SyslogUDPHandler.db_conn = conn
+    writer = threading.Thread(target=db_writer, args=(conn,), name="seimple-db-writer", daemon=True)
+    writer.start()
 
-    server = socketserver.ThreadingUDPServer((listen_addr, port), SyslogUDPHandler)
+    loop = asyncio.new_event_loop()
+    transport, _ = loop.run_until_complete(loop.create_datagram_endpoint(
+        lambda: SyslogProtocol(_write_q), local_addr=(listen_addr, port)
+    ))
     print(f"SEIMple collector (v2) listening on {listen_addr}:{port} (db: {db_path})")
     try:
-        server.serve_forever(poll_interval=0.5)
+        loop.run_forever()
     except KeyboardInterrupt:
         print("Shutting down collector...")
     finally:
-        server.shutdown()
+        transport.close()
+        loop.close()
+        # flush whatever is still queued before closing the DB
+        _write_q.put(None)
+        writer.join()
         conn.close()
 
 if __name__ == "__main__":
@@ -148,5 +350,8 @@ if __name__ == "__main__":
     p.add_argument("--host", default="0.0.0.0", help="Listen address")
     p.add_argument("--port", type=int, default=5514, help="UDP port to listen on (default 5514 for non-root)")
     p.add_argument("--db", default=DB_PATH, help="SQLite DB path")
+    p.add_argument("-v", "--verbose", action="store_true", help="Print every received message")
     args = p.parse_args()
+    logging.basicConfig(format="%(message)s")
+    log.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
     run_server(args.host, args.port, args.db)